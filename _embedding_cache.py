@@ -0,0 +1,47 @@
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+
+CACHE_PATH = os.getenv('EMBED_CACHE_PATH', 'embedding_cache.sqlite3')
+
+# sqlite caps the number of bound variables per statement, so batched SELECTs
+# are chunked well below the historical 999 limit.
+_SELECT_CHUNK = 500
+
+
+class EmbeddingCache:
+    # content-addressed cache: identical text + model never hits the API twice
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS emb (model TEXT, hash BLOB, vec BLOB, PRIMARY KEY (model, hash))'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode()).digest()
+
+    def get_many(self, model: str, hashes: list[bytes]) -> dict[bytes, np.ndarray]:
+        found = {}
+        for start in range(0, len(hashes), _SELECT_CHUNK):
+            chunk = hashes[start:start + _SELECT_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT hash, vec FROM emb WHERE model=? AND hash IN ({placeholders})',
+                [model, *chunk],
+            )
+            for h, vec in rows:
+                found[h] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, items: dict) -> None:
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO emb (model, hash, vec) VALUES (?, ?, ?)',
+            [(model, h, np.asarray(vec, dtype=np.float32).tobytes()) for h, vec in items.items()],
+        )
+        self.conn.commit()
@@ -0,0 +1,39 @@
+import hashlib
+import os
+import sqlite3
+
+
+CACHE_PATH = os.getenv('SUMMARY_CACHE_PATH', 'summary_cache.sqlite3')
+
+
+class SummaryCache:
+    # re-ingesting the same document should not repeat the summary LLM call:
+    # the prompt is fixed and temperature low, so the cached answer is as good
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS summaries (model TEXT, hash BLOB, summary TEXT, PRIMARY KEY (model, hash))'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode()).digest()
+
+    def get(self, model: str, text: str) -> str | None:
+        row = self.conn.execute(
+            'SELECT summary FROM summaries WHERE model=? AND hash=?',
+            (model, self.text_hash(text)),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model: str, text: str, summary: str) -> None:
+        self.conn.execute(
+            'INSERT OR REPLACE INTO summaries (model, hash, summary) VALUES (?, ?, ?)',
+            (model, self.text_hash(text), summary),
+        )
+        self.conn.commit()
+
+
+summary_cache = SummaryCache()
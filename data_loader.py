@@ -1,32 +1,97 @@
-from openai import OpenAI
-from llama_index.readers.file import PDFReader
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import numpy as np
+from openai import AsyncOpenAI
 from llama_index.core.node_parser import SentenceSplitter
 from dotenv import load_dotenv
 
+from _embedding_cache import EmbeddingCache
+
 
 load_dotenv()
 
 # documents chunk into pieces --> Split sentences into chuncks --> Embed --> store into vectorDb.
 
 
-client = OpenAI()
-EMBED_MODEL = 'text-embedding-3-large'
-EMBED_DIM = 3072
+client = AsyncOpenAI()
+EMBED_MODEL = 'text-embedding-3-small'
+EMBED_DIM = 1024    # Matryoshka truncation: v3 models keep most recall at lower dims
+# the dimensions param means the model name alone no longer fixes vector width,
+# so cached vectors are keyed on both to avoid serving stale widths
+EMBED_CACHE_KEY = f'{EMBED_MODEL}@{EMBED_DIM}'
+
+EMBED_BATCH = 96            # inputs per request, keeps each call under the token limits
+EMBED_CONCURRENCY = 8       # in-flight requests at once
 
 splitter = SentenceSplitter(chunk_size=1000, chunk_overlap=200)
 
+embedding_cache = EmbeddingCache()
+
+def _split_page(text: str) -> list[str]:
+    # module-level so worker processes can import it; uses the module splitter
+    return splitter.split_text(text)
+
+
+def _init_worker():
+    # the splitter loads its tokenizer lazily on first use; warming it in the pool
+    # initializer keeps that load off each worker's first real page
+    splitter.split_text('warmup')
+
+
+def iter_pdf_chunks(path: str):
+    # generator: chunks stream out page by page so the caller can embed while later
+    # pages are still being split, instead of materializing the whole PDF first
+    # PyMuPDF extracts text in C, an order of magnitude faster than pypdf-based readers
+    with fitz.open(path) as doc:
+        texts = [t for page in doc if (t := page.get_text('text'))] # skip pages with no extractable text
+    if len(texts) <= 1:
+        for t in texts:
+            yield from _split_page(t)
+        return
+    # splitting is pure-Python tokenization, so fan pages out across processes;
+    # ex.map keeps page order, which keeps chunk ids deterministic.
+    # spawn, not fork: the server process holds asyncio + gRPC state and forked
+    # children can deadlock on inherited locks
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker, mp_context=mp_context) as ex:
+        for page_chunks in ex.map(_split_page, texts, chunksize=4):
+            yield from page_chunks
+
+
 def load_and_chunk_pdf(path: str):
-    docs = PDFReader().load_data(file=path)
-    texts = [d.text for d in docs if getattr(d, 'text', None)] # get text in doc if doc has textattribute
-    chunks = []
-    for t in texts:
-        chunks.extend(splitter.split_text(t))
-    return chunks
-
-
-def embed_texts(texts: list[str]) -> list[list[float]]: # send request to openai --> embed into vector --> pull out embedding
-    response = client.embeddings.create(
-        model=EMBED_MODEL,
-        input=texts,
-    )
-    return [item.embedding for item in response.data]
\ No newline at end of file
+    return list(iter_pdf_chunks(path))
+
+
+async def embed_texts(texts: list[str]) -> np.ndarray: # send request to openai --> embed into vector --> pull out embedding
+    # returns a contiguous (N, EMBED_DIM) float32 array: no per-float Python objects downstream
+    if not texts:
+        return np.empty((0, EMBED_DIM), dtype=np.float32)
+    hashes = [EmbeddingCache.text_hash(t) for t in texts]
+    vectors = embedding_cache.get_many(EMBED_CACHE_KEY, hashes)
+
+    misses = {}  # hash -> text; also dedupes repeated chunks within the batch
+    for h, t in zip(hashes, texts):
+        if h not in vectors:
+            misses[h] = t
+
+    if misses:
+        miss_texts = list(misses.values())
+        batches = [miss_texts[i:i + EMBED_BATCH] for i in range(0, len(miss_texts), EMBED_BATCH)]
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+        async def _embed_batch(batch: list[str]):
+            async with semaphore:
+                response = await client.embeddings.create(model=EMBED_MODEL, input=batch, dimensions=EMBED_DIM)
+                return [item.embedding for item in response.data]
+
+        responses = await asyncio.gather(*[_embed_batch(b) for b in batches])
+        flat = [emb for batch in responses for emb in batch]  # gather preserves batch order
+        fresh = dict(zip(misses, flat))
+        embedding_cache.put_many(EMBED_CACHE_KEY, fresh)
+        vectors.update(fresh)
+
+    return np.asarray([vectors[h] for h in hashes], dtype=np.float32)  # original order
\ No newline at end of file
@@ -1,4 +1,7 @@
+import asyncio
+import itertools
 import logging
+import threading
 from fastapi import FastAPI
 import inngest
 import inngest.fast_api
@@ -6,13 +9,16 @@ from inngest.experimental import ai
 from groq import Groq
 from dotenv import load_dotenv
 from email.mime.text import MIMEText
+import hashlib
 import uuid
 import os
 import datetime
-import smtplib
-from data_loader import load_and_chunk_pdf, embed_texts
-from vector_db import QdrantStorage
-from custom_types import RAGChunkAndSrc, RAGQueryResult, RAGSearchResult, RAGUpsertResult
+import aiosmtplib
+from _summary_cache import summary_cache
+from data_loader import iter_pdf_chunks, embed_texts
+from semantic_cache import query_cache
+from vector_db import get_storage, batch_searcher
+from custom_types import RAGQueryResult, RAGSearchResult, RAGUpsertResult
 
 
 load_dotenv()
@@ -26,29 +32,82 @@ inngest_client = inngest.Inngest(
 
 # uploaded documents are not directly sent to API endpoint. Instead, these requests are sent to Inngest server. This forwards the request (with PDF) to API.  
 
+CHUNK_BATCH = 128       # chunks embedded + upserted per pipeline batch
+PIPELINE_DEPTH = 4      # batches buffered between chunking and embedding, caps memory
+SUMMARY_MODEL = 'gpt-4o-mini'
+
+_smtp = None
+
+async def _get_smtp() -> aiosmtplib.SMTP:
+    # keep one logged-in SMTP connection per process: the TLS handshake + LOGIN
+    # cost ~500 ms and dominated each alert when done per send
+    global _smtp
+    if _smtp is None or not _smtp.is_connected:
+        _smtp = aiosmtplib.SMTP(hostname="smtp.gmail.com", port=465, use_tls=True)
+        await _smtp.connect()
+        await _smtp.login(os.getenv("GMAIL_SENDER"), os.getenv("GMAIL_APP_PASSWORD"))
+    return _smtp
+
 @inngest_client.create_function(
     fn_id='RAG: Ingest PDF',
     trigger=inngest.TriggerEvent(event='rag/ingest_pdf')
 )
 async def rag_ingest_pdf(ctx: inngest.Context):
-    def _load(ctx: inngest.Context) -> RAGChunkAndSrc:
+    async def _ingest(ctx: inngest.Context) -> RAGUpsertResult:     # uploads and inserts chunks/source_ids into qdrantDb
         pdf_path = ctx.event.data['pdf_path']
         source_id = ctx.event.data.get('source_id', pdf_path)
-        chunks = load_and_chunk_pdf(pdf_path)
-        return RAGChunkAndSrc(chunks=chunks, source_id=source_id)
-
-    def _upsert(chunks_and_src: RAGChunkAndSrc) -> RAGUpsertResult:     # uploads and inserts chunks/source_ids into qdrantDb
-        chunks = chunks_and_src.chunks
-        source_id = chunks_and_src.source_id
-        vecs = embed_texts(chunks)
-        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source_id}: {i}")) for i in range(len(chunks))]
-        payloads = [{"source": source_id, "text": chunks[i]} for i in range(len(chunks))]
-        QdrantStorage().upsert(ids, vecs, payloads)
-        return RAGUpsertResult(ingested=len(chunks))
-
-    # run these steps chronological by adding 'await'. By removing 'await': steps can be run parallel
-    chunks_and_src = await ctx.step.run('load-and-chunk', lambda: _load(ctx), output_type=RAGChunkAndSrc)      # wrap into an inngest 'step'           
-    ingested = await ctx.step.run('embed-and-upsert', lambda: _upsert(chunks_and_src), output_type=RAGUpsertResult)
+
+        # pipeline: a thread splits pages into chunk batches while this coroutine
+        # embeds and upserts the previous batch, so I/O overlaps the chunking CPU work
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_DEPTH)
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()    # lets the consumer shut the producer down on failure
+
+        def _produce():
+            try:
+                chunk_iter = iter_pdf_chunks(pdf_path)
+                while batch := list(itertools.islice(chunk_iter, CHUNK_BATCH)):
+                    asyncio.run_coroutine_threadsafe(queue.put(batch), loop).result()
+                    if stop.is_set():
+                        return
+            finally:
+                # always wake the consumer, even when chunking raised; on consumer
+                # failure the queue is being drained so this put cannot block forever
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()   # done
+
+        producer = asyncio.create_task(asyncio.to_thread(_produce))
+
+        store = get_storage()
+        ingested = 0
+        try:
+            while (batch := await queue.get()) is not None:
+                # ids hash the chunk text, so an edited PDF only re-embeds chunks that actually changed
+                # (index-based ids shifted on any inserted page and re-embedded everything after it)
+                by_id = {
+                    str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source_id}:{hashlib.sha256(c.encode()).hexdigest()}")): c
+                    for c in batch
+                }
+                already_stored = store.existing_ids(list(by_id))
+                new = {i: c for i, c in by_id.items() if i not in already_stored}
+                if new:
+                    vecs = await embed_texts(list(new.values()))    # batched + concurrent under the hood
+                    payloads = [{"source": source_id, "text": c} for c in new.values()]
+                    store.upsert(list(new), vecs, payloads)
+                    ingested += len(new)
+        except BaseException:
+            # let the producer thread exit before propagating, or it stays blocked
+            # on the full queue and permanently eats a default-executor thread
+            stop.set()
+            while not producer.done():
+                try:
+                    queue.get_nowait()      # free space so a blocked put can finish
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.01)
+            raise
+        await producer      # re-raises anything iter_pdf_chunks threw
+        return RAGUpsertResult(ingested=ingested)
+
+    ingested = await ctx.step.run('ingest-stream', lambda: _ingest(ctx), output_type=RAGUpsertResult)
     return ingested.model_dump()    # converts model into py dict / json
 
 ###################################################################################################
@@ -62,40 +121,43 @@ async def rag_alert_new_doc(ctx: inngest.Context):
     chunks = ctx.event.data["chunks"][:5]  
     context_block = "\n\n".join(chunks)
 
-    adapter = ai.openai.Adapter(
-        auth_key=os.getenv("OPENAI_API_KEY"),
-        model="gpt-4o-mini"
-    )
-
-    res = await ctx.step.ai.infer(
-        "doc-summary",
-        adapter=adapter,
-        body={
-            "max_tokens": 1024,
-            "temperature": 0.2,
-            "messages": [
-                {"role": "system", "content": "You summarize new documents for alerting emails."},
-                {"role": "user", "content": f"Summarize this document:\n{context_block}"}
-            ]
-        }
-    )
-    summary = res["choices"][0]["message"]["content"].strip()
-
-    # send gmail notification
-    sender = os.getenv("GMAIL_SENDER")
-    recipient = os.getenv("GMAIL_RECEIVER")
-    app_password = os.getenv("GMAIL_APP_PASSWORD")
-
-    msg = MIMEText(f"New document ingested: {source_id}\n\nSummary:\n{summary}")
-    msg["Subject"] = f"👮‍♂️🚨RAG-AGENT: new document alert: {source_id}"
-    msg["From"] = sender
-    msg["To"] = recipient
-
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-        server.login(sender, app_password)
-        server.sendmail(sender, [recipient], msg.as_string())
-
-    return {"alert_sent": True, "summary": summary}
+    # re-ingests of the same document hit the cache instead of the LLM
+    summary = summary_cache.get(SUMMARY_MODEL, context_block)
+    if summary is None:
+        adapter = ai.openai.Adapter(
+            auth_key=os.getenv("OPENAI_API_KEY"),
+            model=SUMMARY_MODEL
+        )
+
+        res = await ctx.step.ai.infer(
+            "doc-summary",
+            adapter=adapter,
+            body={
+                "max_tokens": 1024,
+                "temperature": 0.2,
+                "messages": [
+                    {"role": "system", "content": "You summarize new documents for alerting emails."},
+                    {"role": "user", "content": f"Summarize this document:\n{context_block}"}
+                ]
+            }
+        )
+        summary = res["choices"][0]["message"]["content"].strip()
+        summary_cache.put(SUMMARY_MODEL, context_block, summary)
+
+    # send gmail notification; its own step so the (checkpointed) summary isn't
+    # redone if the send fails and retries
+    async def _send_alert() -> bool:
+        msg = MIMEText(f"New document ingested: {source_id}\n\nSummary:\n{summary}")
+        msg["Subject"] = f"👮‍♂️🚨RAG-AGENT: new document alert: {source_id}"
+        msg["From"] = os.getenv("GMAIL_SENDER")
+        msg["To"] = os.getenv("GMAIL_RECEIVER")
+        server = await _get_smtp()
+        await server.send_message(msg)
+        return True
+
+    alert_sent = await ctx.step.run('send-alert', _send_alert)
+
+    return {"alert_sent": alert_sent, "summary": summary}
 
 ###################################################################################################
 @inngest_client.create_function(
@@ -103,16 +165,26 @@ async def rag_alert_new_doc(ctx: inngest.Context):
     trigger=inngest.TriggerEvent(event='rag/query_pdf_ai')
 )
 async def rag_query_pdf_ai(ctx: inngest.Context):
-    def _search(question: str, top_k: int = 5) -> RAGSearchResult:
-        query_vec = embed_texts([question])[0]
-        store = QdrantStorage()
-        found = store.search(query_vec, top_k)
+    async def _embed_query(question: str) -> list[float]:
+        # step outputs must be JSON-serializable, so the ndarray row becomes a list here
+        return (await embed_texts([question]))[0].tolist()
+
+    async def _search(query_vec: list[float], top_k: int = 5) -> RAGSearchResult:
+        # concurrent questions get coalesced into a single Qdrant round-trip
+        found = await batch_searcher.submit(query_vec, top_k)
         return RAGSearchResult(contexts=found['contexts'], sources=found['sources'])
-    
+
     question = ctx.event.data['question']
     top_k = int(ctx.event.data.get('top_k', 5))
 
-    found = await ctx.step.run('embed-and-search', lambda: _search(question, top_k), output_type=RAGSearchResult) 
+    query_vec = await ctx.step.run('embed-query', lambda: _embed_query(question))
+
+    # same (or nearly the same) question asked before: reuse the cached answer
+    cached = query_cache.lookup(query_vec)
+    if cached is not None:
+        return cached.model_dump()
+
+    found = await ctx.step.run('search', lambda: _search(query_vec, top_k), output_type=RAGSearchResult)
 
     context_block = "\n\n".join(f"- {c}" for c in found.contexts)
     user_content = (
@@ -141,7 +213,9 @@ async def rag_query_pdf_ai(ctx: inngest.Context):
     )
 
     answer = res["choices"][0]["message"]["content"].strip()
-    return {"answer": answer, "sources": found.sources, "num_contexts": len(found.contexts)}
+    result = RAGQueryResult(answer=answer, sources=found.sources, num_contexts=len(found.contexts))
+    query_cache.add(query_vec, result)
+    return result.model_dump()
 
 
 
@@ -0,0 +1,66 @@
+import atexit
+import os
+
+import numpy as np
+
+from custom_types import RAGQueryResult
+from data_loader import EMBED_DIM
+
+
+CACHE_PATH = os.getenv('QUERY_CACHE_PATH', 'query_cache.npz')
+SIM_THRESHOLD = 0.97    # cosine similarity above which two questions count as the same
+MAX_ENTRIES = 4096
+SCALE = 127             # int8 quantization scale; safe because vectors are L2-normalized
+
+
+class SemanticCache:
+    # near-duplicate questions reuse the previous answer instead of hitting Qdrant + the LLM
+
+    def __init__(self, path: str = CACHE_PATH, dim: int = EMBED_DIM):
+        self.path = path
+        # int8 rows instead of float32 quarter the resident size of the cache matrix
+        self.vectors = np.empty((0, dim), dtype=np.int8)    # quantized normalized query vectors
+        self.results: list[RAGQueryResult] = []
+        if os.path.exists(path):
+            data = np.load(path)
+            vectors = data['vectors']
+            if vectors.dtype != np.int8:    # cache file written before quantization
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = np.round(vectors / norms * SCALE).astype(np.int8)
+            self.vectors = vectors
+            self.results = [RAGQueryResult.model_validate_json(s) for s in data['results']]
+
+    @staticmethod
+    def _quantize(query_vector: list[float]) -> np.ndarray:
+        q = np.asarray(query_vector, dtype=np.float32)
+        q /= np.linalg.norm(q)
+        return np.round(q * SCALE).astype(np.int8)
+
+    def lookup(self, query_vector: list[float]) -> RAGQueryResult | None:
+        if not self.results:
+            return None
+        q = self._quantize(query_vector)
+        # int8 dot products accumulated in int32; scores live on the 127*127 scale
+        sims = np.matmul(self.vectors, q, dtype=np.int32)
+        best = int(np.argmax(sims))
+        if sims[best] > SIM_THRESHOLD * SCALE * SCALE:
+            return self.results[best]
+        return None
+
+    def add(self, query_vector: list[float], result: RAGQueryResult) -> None:
+        self.vectors = np.vstack([self.vectors, self._quantize(query_vector)])
+        self.results.append(result)
+        if len(self.results) > MAX_ENTRIES:     # FIFO eviction
+            self.vectors = self.vectors[-MAX_ENTRIES:]
+            self.results = self.results[-MAX_ENTRIES:]
+
+    def save(self) -> None:
+        np.savez(
+            self.path,
+            vectors=self.vectors,
+            results=np.array([r.model_dump_json() for r in self.results]),
+        )
+
+
+query_cache = SemanticCache()
+atexit.register(query_cache.save)